@@ -5,13 +5,14 @@ PRAGMA foreign_keys = ON;
 -------------------------------
 CREATE TABLE IF NOT EXISTS orders (
   order_id      INTEGER PRIMARY KEY AUTOINCREMENT,
-  created_at    TEXT NOT NULL,              -- ISO8601 時間
+  created_at    TEXT NOT NULL,              -- ISO8601 本地時間（寫入時由 SQL 的 strftime 產生）
   vendor        TEXT NOT NULL,              -- 店家/團名
   note          TEXT DEFAULT '',
   creator_id    TEXT NOT NULL,              -- Discord user id（開單人）
   payer_id      TEXT NOT NULL,              -- 付款人（通常同 creator）
   discount_type TEXT NOT NULL DEFAULT 'none',  -- none | percent | amount
-  discount_value REAL NOT NULL DEFAULT 0,      -- percent: 0.9, amount: 50
+  discount_bps  INTEGER NOT NULL DEFAULT 0,    -- percent 折扣的基點：0.9 → 9000（唯一存的折扣值，純整數計算）
+  discount_value REAL GENERATED ALWAYS AS (discount_bps / 10000.0) VIRTUAL,  -- 顯示用：0.9（由 discount_bps 算）
   status        TEXT NOT NULL DEFAULT 'open',   -- open | locked | cancelled
   adjustment INTEGER NOT NULL DEFAULT 0      -- 調整金額（正數代表加，負數代表扣）
 );
@@ -29,6 +30,7 @@ CREATE TABLE IF NOT EXISTS line_items (
   note        TEXT DEFAULT '',
   created_at  TEXT NOT NULL,
   created_by  TEXT NOT NULL,       -- 是誰輸入這筆（可跟 user_id 不同）
+  line_total  INTEGER GENERATED ALWAYS AS (unit_price * qty) STORED,  -- 小計（寫入時算好）
   FOREIGN KEY(order_id) REFERENCES orders(order_id) ON DELETE CASCADE
 );
 
@@ -38,6 +40,7 @@ CREATE TABLE IF NOT EXISTS line_items (
 CREATE TABLE IF NOT EXISTS participants (
   order_id   INTEGER NOT NULL,
   user_id    TEXT NOT NULL,
+  subtotal   INTEGER NOT NULL DEFAULT 0,   -- Σ line_total（折扣前，recalc 時寫入）
   total_due  INTEGER NOT NULL DEFAULT 0 CHECK(total_due >= 0),
   paid       INTEGER NOT NULL DEFAULT 0 CHECK(paid IN (0,1)),
   paid_at    TEXT,
@@ -49,6 +52,40 @@ CREATE TABLE IF NOT EXISTS participants (
 -------------------------------
 -- 常用索引（讓查詢更快）
 -------------------------------
-CREATE INDEX IF NOT EXISTS idx_line_items_order ON line_items(order_id);
+-- 舊版索引已被下面的索引取代（前綴相同或更精簡），重跑 init_db 時順手清掉
+DROP INDEX IF EXISTS idx_line_items_order;
+DROP INDEX IF EXISTS idx_orders_status;
+DROP INDEX IF EXISTS idx_participants_user_paid;
+
 CREATE INDEX IF NOT EXISTS idx_participants_user ON participants(user_id);
-CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status);
+
+-- get_bill / recalc：依訂單 + 人撈品項
+CREATE INDEX IF NOT EXISTS idx_line_items_order_user ON line_items(order_id, user_id, item_id);
+-- get_user_debt / /my 未付清：只索引還沒付的（partial index，很小；paid 固定為 0 所以不用放進欄位）
+CREATE INDEX IF NOT EXISTS idx_participants_unpaid ON participants(user_id, order_id) WHERE paid=0;
+-- /my 我開的團
+CREATE INDEX IF NOT EXISTS idx_orders_creator_created ON orders(creator_id, created_at DESC) WHERE status!='cancelled';
+-- autocomplete / picker
+CREATE INDEX IF NOT EXISTS idx_orders_status_id ON orders(status, order_id DESC);
+
+-------------------------------
+-- 4) autocomplete 用的 vendor 全文索引（trigram：支援 LIKE '%kw%'）
+-------------------------------
+CREATE VIRTUAL TABLE IF NOT EXISTS orders_fts USING fts5(
+  vendor,
+  content='orders',
+  content_rowid='order_id',
+  tokenize='trigram'
+);
+
+-- 跟 orders 同步（status 等其他欄位變動不影響）
+CREATE TRIGGER IF NOT EXISTS orders_fts_ai AFTER INSERT ON orders BEGIN
+  INSERT INTO orders_fts(rowid, vendor) VALUES (new.order_id, new.vendor);
+END;
+CREATE TRIGGER IF NOT EXISTS orders_fts_ad AFTER DELETE ON orders BEGIN
+  INSERT INTO orders_fts(orders_fts, rowid, vendor) VALUES ('delete', old.order_id, old.vendor);
+END;
+CREATE TRIGGER IF NOT EXISTS orders_fts_au AFTER UPDATE OF vendor ON orders BEGIN
+  INSERT INTO orders_fts(orders_fts, rowid, vendor) VALUES ('delete', old.order_id, old.vendor);
+  INSERT INTO orders_fts(rowid, vendor) VALUES (new.order_id, new.vendor);
+END;
@@ -1,14 +1,19 @@
 from __future__ import annotations
 
+import asyncio
+import contextlib
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
 from typing import Optional
 
+import aiohttp
 import discord
 from discord import app_commands
 
 # 數學運算用
 import re
-import ast
 import operator
 
 # 你的核心邏輯
@@ -20,13 +25,14 @@ from src.db import (
     get_user_overview,
     mark_paid,
     set_discount_percent,
-    search_orders_for_picker,
-    lock_order,
+    search_orders_for_picker_labels,
+    lock_order_and_get_bill,
     unlock_order,
     cancel_order,
+    optimize,
 )
 
-# UI 顯示用（DB 仍用 open/locked/cancelled）
+# UI 顯示用（DB 仍用 open/locked/cancelled；autocomplete label 在 src/db.py 的 SQL 裡也有一份）
 STATUS_LABEL = {
     "open": "開放中",
     "locked": "收單",
@@ -34,8 +40,9 @@ STATUS_LABEL = {
 }
 
 
-def status_text(status: str) -> str:
-    return STATUS_LABEL.get(status, status)
+# 直接綁 dict.get：每列都會查一次，省掉一層 Python 函式呼叫
+# 用法：_status_text(status, status)（查不到就顯示原字串）
+_status_text = STATUS_LABEL.get
 
 
 def uid(user: discord.abc.User) -> str:
@@ -43,8 +50,43 @@ def uid(user: discord.abc.User) -> str:
     return str(user.id)
 
 
-def money(n: int) -> str:
-    return f"{n}"
+# 金額目前就是整數原樣輸出；直接用 str（C 實作）省掉一層函式呼叫
+money = str
+
+
+# SQLite 是同步 I/O：丟到 thread 跑，避免卡住 event loop（心跳、其他指令、算式回覆）
+_DB_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="db")
+
+
+async def _db(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_DB_POOL, partial(fn, *args, **kwargs))
+
+
+async def _followup_error(interaction: discord.Interaction, message: str) -> None:
+    """
+    defer 之後的錯誤訊息一律私訊。
+    defer 後第一個 followup 會沿用 defer 的可見度（ephemeral=True 無效），
+    所以先刪掉公開的「思考中…」，錯誤才會是新的、只有自己看得到的訊息。
+    """
+    try:
+        await interaction.delete_original_response()
+    except discord.HTTPException:
+        pass
+    await interaction.followup.send(message, ephemeral=True)
+
+
+# 長駐時定期跑 PRAGMA optimize，讓 planner 的統計跟上資料量
+_OPTIMIZE_INTERVAL = 6 * 60 * 60
+
+
+async def _optimize_loop() -> None:
+    while True:
+        await asyncio.sleep(_OPTIMIZE_INTERVAL)
+        try:
+            await _db(optimize)
+        except Exception as e:
+            print(f"⚠️ PRAGMA optimize 失敗：{e}")
 
 
 class AccountingBot(discord.Client):
@@ -53,8 +95,25 @@ class AccountingBot(discord.Client):
         intents.message_content = True
         super().__init__(intents=intents)
         self.tree = app_commands.CommandTree(self)
+        self._optimize_task: Optional[asyncio.Task] = None
+
+    async def login(self, token: str) -> None:
+        # 自己建 REST 用的 connector（要在 event loop 裡建，所以放在 login 而不是 __init__）：
+        # 連線數維持 discord.py 預設的不設上限（也不限定 IPv4/IPv6），
+        # 只拉長 keep-alive 與 DNS 快取，讓 /bill 一次抓多個成員時能重用既有的 TCP+TLS 連線
+        if self.http.connector is discord.utils.MISSING:
+            self.http.connector = aiohttp.TCPConnector(
+                limit=0,
+                ttl_dns_cache=300,
+                keepalive_timeout=75,
+            )
+        await super().login(token)
 
     async def setup_hook(self) -> None:
+        # setup_hook 理論上只跑一次，還是擋一下，避免同時跑兩個排程
+        if self._optimize_task is None or self._optimize_task.done():
+            self._optimize_task = asyncio.create_task(_optimize_loop())
+
         # ✅ 建議先用「Guild sync」：指令幾乎立刻生效（測試期超重要）
         guild_id = os.getenv("DISCORD_GUILD_ID")
         if guild_id:
@@ -67,45 +126,176 @@ class AccountingBot(discord.Client):
             await self.tree.sync()
             print("✅ Slash commands synced globally (may take time)")
 
+    async def close(self) -> None:
+        # 先停掉排程再關，避免 event loop 收掉時還有 pending 的 task
+        task, self._optimize_task = self._optimize_task, None
+        if task is not None:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        await super().close()
+
 
 bot = AccountingBot()
 
 
+# 顯示名稱快取：(guild_id, user_id) -> (過期時間, 名稱)
+_NAME_CACHE: dict[tuple[int, int], tuple[float, str]] = {}
+_NAME_TTL = 300.0
+# 缺的名字超過這個數量才用 query_members 一次抓
+_QUERY_MEMBERS_THRESHOLD = 3
+# query_members 最多等幾秒（gateway 沒回應時不要卡住 /bill）
+_QUERY_MEMBERS_TIMEOUT = 2.0
+
+
+def _cached_name(guild_id: int, user_id: int) -> Optional[str]:
+    hit = _NAME_CACHE.get((guild_id, user_id))
+    if hit and hit[0] > time.monotonic():
+        return hit[1]
+    return None
+
+
+def _remember_name(guild_id: int, user_id: int, name: str) -> str:
+    _NAME_CACHE[(guild_id, user_id)] = (time.monotonic() + _NAME_TTL, name)
+    return name
+
+
 async def display_name_for(interaction: discord.Interaction, user_id: str) -> str:
     """用 user_id 取得在該 guild 的顯示名稱（優先暱稱）。抓不到就退回 username / user_id。"""
     uid_int = int(user_id)
+    guild_id = interaction.guild.id if interaction.guild else 0
+
+    # 最優先：自己的 TTL 快取（不用打 API）
+    cached = _cached_name(guild_id, uid_int)
+    if cached is not None:
+        return cached
 
     # 優先：快取（最省）
     if interaction.guild:
         m = interaction.guild.get_member(uid_int)
         if m:
-            return m.display_name
+            return _remember_name(guild_id, uid_int, m.display_name)
 
         # 次選：REST 抓 guild member（不依賴 members intent）
         try:
             m = await interaction.guild.fetch_member(uid_int)
-            return m.display_name
+            return _remember_name(guild_id, uid_int, m.display_name)
         except Exception:
             pass
 
     # 再退：抓 user（全域 username）
     try:
         u = await bot.fetch_user(uid_int)
-        return u.name
+        return _remember_name(guild_id, uid_int, u.name)
     except Exception:
         return user_id
 
 
+async def resolve_names(interaction: discord.Interaction, user_ids: list[str]) -> dict[str, str]:
+    """
+    一次解析多個 user_id 的顯示名稱：
+    先查 TTL 快取與 guild 成員快取，剩下的才併發打 REST（N 次來回 → 一輪）。
+    """
+    guild = interaction.guild
+    guild_id = guild.id if guild else 0
+
+    names: dict[str, str] = {}
+    missing: list[str] = []
+    for user_id in dict.fromkeys(user_ids):  # 去重但保留順序
+        uid_int = int(user_id)
+        cached = _cached_name(guild_id, uid_int)
+        if cached is not None:
+            names[user_id] = cached
+            continue
+        m = guild.get_member(uid_int) if guild else None
+        if m:
+            names[user_id] = _remember_name(guild_id, uid_int, m.display_name)
+        else:
+            missing.append(user_id)
+
+    # 缺很多人時：一次 gateway query 拿回一批，比 N 個 fetch_member 省
+    if guild and len(missing) > _QUERY_MEMBERS_THRESHOLD:
+        try:
+            # query_members 自己要等 30 秒才 timeout：gateway 沒回就早點放棄，改走 fetch
+            members = await asyncio.wait_for(
+                guild.query_members(user_ids=[int(u) for u in missing[:100]], limit=100),
+                timeout=_QUERY_MEMBERS_TIMEOUT,
+            )
+        except (asyncio.TimeoutError, discord.ClientException):
+            # 例如沒開 members intent、或 gateway 沒回 → 退回逐一 fetch
+            members = []
+        for m in members:
+            names[str(m.id)] = _remember_name(guild_id, m.id, m.display_name)
+        missing = [u for u in missing if u not in names]
+
+    if missing:
+        fetched = await asyncio.gather(*(display_name_for(interaction, u) for u in missing))
+        names.update(zip(missing, fetched))
+
+    return names
+
+
+# autocomplete 每打一個字就觸發一次：同一個前綴在 2 秒內只查一次 DB
+_AUTOCOMPLETE_TTL = 2.0
+
+
+@lru_cache(maxsize=256)
+def _cached_order_choices(current: str, limit: int, bucket: int) -> tuple[app_commands.Choice[int], ...]:
+    # bucket 只用來讓快取每 _AUTOCOMPLETE_TTL 秒自然失效
+    # label 已在 SQL 組好（含 100 字截斷），這裡不做任何字串處理
+    rows = search_orders_for_picker_labels(current, limit=limit)
+    choices = [app_commands.Choice(name=label, value=order_id) for order_id, label in rows]
+
+    return tuple(choices)
+
+
 async def order_id_autocomplete(interaction: discord.Interaction, current: str):
-    rows = search_orders_for_picker(current or "", limit=25)
+    bucket = int(time.monotonic() / _AUTOCOMPLETE_TTL)
+    return list(await _db(_cached_order_choices, current or "", 25, bucket))
+
+
+async def _render_bill_embed(
+    interaction: discord.Interaction,
+    data: dict,
+    title_prefix: str = "訂單",
+    show_payer: bool = False,
+) -> discord.Embed:
+    """把 get_bill 的結果排成 embed（/bill 與 /lock 共用）。"""
+    order = data["order"]
+    parts = data["participants"]
+
+    created_at = order["created_at"].replace("T", " ")[:16]
+    payer_line = f"付款人：<@{order.get('payer_id', '')}>\n" if show_payer else ""
+
+    embed = discord.Embed(
+        title=f"{title_prefix} #{order['order_id']}｜{order['vendor']}",
+        description=(
+            f"📅 建立時間：**{created_at}**\n"
+            f"{payer_line}"
+            f"狀態：**{_status_text(order['status'], order['status'])}**｜折扣：`{order['discount_type']} {order['discount_value']}`"
+        ),
+    )
 
-    choices = []
-    for o in rows:
-        # Discord autocomplete 每個 label 最長 100 字
-        label = f"#{o['order_id']} | {o['vendor']} | {o['created_at'][:16]} | {status_text(o['status'])}"
-        choices.append(app_commands.Choice(name=label[:100], value=int(o["order_id"])))
+    names = await resolve_names(interaction, [p["user_id"] for p in parts])
 
-    return choices
+    for p in parts:
+        u = p["user_id"]
+        paid = "✅已付" if p["paid"] else "❌未付"
+
+        lines = [
+            "- %s x%d @ %d = %d%s"
+            % (it["name"], it["qty"], it["unit_price"], it["line_total"], f"（{it['note']}）" if it["note"] else "")
+            for it in p["items"]
+        ]
+        header = f"👤 <@{u}>\n"
+
+        embed.add_field(
+            name=f"{names[u]}｜應付 {money(p['total_due'])}｜{paid}",
+            value=header + "\n".join(lines) if lines else header + "- （無品項）",
+            inline=False,
+        )
+
+    return embed
 
 
 # -----------------------
@@ -122,7 +312,7 @@ async def open_cmd(
     creator_id = uid(interaction.user)
     payer_id = uid(payer) if payer else creator_id
 
-    order_id = create_order(vendor=vendor, creator_id=creator_id, payer_id=payer_id, note=note or "")
+    order_id = await _db(create_order, vendor=vendor, creator_id=creator_id, payer_id=payer_id, note=note or "")
 
     await interaction.response.send_message(
         f"✅ 已開單：`#{order_id}`\n店家：**{vendor}**\n付款人：<@{payer_id}>",
@@ -152,19 +342,21 @@ async def add_cmd(
     user: Optional[discord.Member] = None,
     note: Optional[str] = "",
 ):
+    me_id = uid(interaction.user)
     try:
-        target = user or interaction.user
-        item_id = add_item(
+        target_id = uid(user) if user else me_id
+        item_id = await _db(
+            add_item,
             order_id=order_id,
-            user_id=uid(target),
+            user_id=target_id,
             name=item,
             unit_price=int(price),
             qty=int(qty or 1),
             note=note or "",
-            created_by=uid(interaction.user),
+            created_by=me_id,
         )
         await interaction.response.send_message(
-            f"✅ 已加入 `#{order_id}`：<@{uid(target)}> - **{item}** x{qty or 1} @ {price}（item_id={item_id}）",
+            f"✅ 已加入 `#{order_id}`：<@{target_id}> - **{item}** x{qty or 1} @ {price}（item_id={item_id}）",
             ephemeral=False,
         )
     except Exception as e:
@@ -178,44 +370,14 @@ async def add_cmd(
 @app_commands.autocomplete(order_id=order_id_autocomplete)
 @app_commands.describe(order_id="訂單編號（例如 12）")
 async def bill_cmd(interaction: discord.Interaction, order_id: int):
+    # 先 ACK：查 DB + 抓名字可能超過 Discord 3 秒的回應期限（錯誤由 _followup_error 私訊）
+    await interaction.response.defer(ephemeral=False)
     try:
-        data = get_bill(order_id)
-        order = data["order"]
-        parts = data["participants"]
-
-        created_at = order["created_at"].replace("T", " ")[:16]
-
-        embed = discord.Embed(
-            title=f"訂單 #{order['order_id']}｜{order['vendor']}",
-            description=(
-                f"📅 建立時間：**{created_at}**\n"
-                f"狀態：**{status_text(order['status'])}**｜折扣：`{order['discount_type']} {order['discount_value']}`"
-            ),
-        )
-
-        for p in parts:
-            u = p["user_id"]
-            paid = "✅已付" if p["paid"] else "❌未付"
-
-            lines = []
-            for it in p["items"]:
-                note = f"（{it['note']}）" if it["note"] else ""
-                lines.append(f"- {it['name']} x{it['qty']} @ {it['unit_price']} = {it['line_total']} {note}")
-            if not lines:
-                lines.append("- （無品項）")
-
-            display_name = await display_name_for(interaction, u)
-            value_lines = [f"👤 <@{u}>"] + lines
-
-            embed.add_field(
-                name=f"{display_name}｜應付 {money(p['total_due'])}｜{paid}",
-                value="\n".join(value_lines),
-                inline=False,
-            )
-
-        await interaction.response.send_message(embed=embed, ephemeral=False)
+        data = await _db(get_bill, order_id)
+        embed = await _render_bill_embed(interaction, data)
+        await interaction.followup.send(embed=embed)
     except Exception as e:
-        await interaction.response.send_message(f"❌ 查詢失敗：{e}", ephemeral=True)
+        await _followup_error(interaction, f"❌ 查詢失敗：{e}")
 
 
 # -----------------------
@@ -228,17 +390,17 @@ async def debt_cmd(
     user: Optional[discord.Member] = None,
     public: Optional[bool] = True,
 ):
-    target = user or interaction.user
+    target_id = uid(user or interaction.user)
+    ephemeral = not bool(public)
+    await interaction.response.defer(ephemeral=ephemeral)
     try:
-        debt = get_user_debt(uid(target))
+        debt = await _db(get_user_debt, target_id)
         total = debt["total_debt"]
         details = debt["details"]
 
-        ephemeral = not bool(public)
-
         if not details:
-            await interaction.response.send_message(
-                f"✅ <@{uid(target)}> 目前沒有未付清欠款。",
+            await interaction.followup.send(
+                f"✅ <@{target_id}> 目前沒有未付清欠款。",
                 ephemeral=ephemeral,
             )
             return
@@ -247,12 +409,12 @@ async def debt_cmd(
         for d in details[:20]:
             lines.append(f"- `#{d['order_id']}` {d['vendor']}（欠 <@{d['payer_id']}>）：{money(d['amount'])}")
 
-        await interaction.response.send_message(
-            f"📌 <@{uid(target)}> 的欠款\n" + "\n".join(lines),
+        await interaction.followup.send(
+            f"📌 <@{target_id}> 的欠款\n" + "\n".join(lines),
             ephemeral=ephemeral,
         )
     except Exception as e:
-        await interaction.response.send_message(f"❌ 查詢失敗：{e}", ephemeral=True)
+        await _followup_error(interaction, f"❌ 查詢失敗：{e}")
 
 
 
@@ -263,12 +425,14 @@ async def debt_cmd(
 @bot.tree.command(name="my", description="個人總覽：我欠多少、最近已付、我開的團")
 async def my_cmd(interaction: discord.Interaction):
     me_id = uid(interaction.user)
+    await interaction.response.defer(ephemeral=True)
     try:
-        data = get_user_overview(me_id, limit=10)
+        data = await _db(get_user_overview, me_id, limit=10)
 
         unpaid = data["unpaid"]
         paid_recent = data["paid_recent"]
         my_orders = data["my_orders"]
+        _st = _status_text
 
         embed = discord.Embed(
             title=f"👤 {interaction.user.display_name} 的總覽",
@@ -277,14 +441,11 @@ async def my_cmd(interaction: discord.Interaction):
 
         # 未付清
         if unpaid:
-            lines = []
-            total_unpaid = 0
-            for r in unpaid:
-                amt = int(r["total_due"] or 0)
-                total_unpaid += amt
-                lines.append(
-                    f"- `#{r['order_id']}` {r['vendor']}｜{status_text(r['status'])}｜欠 {money(amt)}（付給 <@{r['payer_id']}>）"
-                )
+            lines = [
+                f"- `#{r['order_id']}` {r['vendor']}｜{_st(r['status'], r['status'])}｜欠 {int(r['total_due'] or 0)}（付給 <@{r['payer_id']}>）"
+                for r in unpaid
+            ]
+            total_unpaid = data["unpaid_total"]
             embed.add_field(
                 name=f"📌 尚未付清（{len(unpaid)}）｜合計 {money(total_unpaid)}",
                 value="\n".join(lines),
@@ -299,12 +460,10 @@ async def my_cmd(interaction: discord.Interaction):
 
         # 最近已付
         if paid_recent:
-            lines = []
-            for r in paid_recent:
-                amt = int(r["total_due"] or 0)
-                lines.append(
-                    f"- `#{r['order_id']}` {r['vendor']}｜{status_text(r['status'])}｜{money(amt)}（付給 <@{r['payer_id']}>）"
-                )
+            lines = [
+                f"- `#{r['order_id']}` {r['vendor']}｜{_st(r['status'], r['status'])}｜{int(r['total_due'] or 0)}（付給 <@{r['payer_id']}>）"
+                for r in paid_recent
+            ]
             embed.add_field(
                 name=f"✅ 最近已付（{len(paid_recent)}）",
                 value="\n".join(lines),
@@ -313,33 +472,29 @@ async def my_cmd(interaction: discord.Interaction):
 
         # 我開的團
         if my_orders:
-            lines = []
-            for r in my_orders:
-                people = int(r.get("people_count") or 0)
-                total = int(r.get("total_after_discount") or 0)
-                discount = f"{r.get('discount_type')} {r.get('discount_value')}"
-                lines.append(
-                    f"- `#{r['order_id']}` {r['vendor']}｜{status_text(r['status'])}｜{people} 人｜"
-                    f"折後總計 {money(total)}｜折扣 `{discount}`｜付款人 <@{r['payer_id']}>"
-)
-
+            lines = [
+                f"- `#{r['order_id']}` {r['vendor']}｜{_st(r['status'], r['status'])}｜{int(r['people_count'] or 0)} 人｜"
+                f"折後總計 {int(r['total_after_discount'] or 0)}｜折扣 `{r['discount_type']} {r['discount_value']}`｜"
+                f"付款人 <@{r['payer_id']}>"
+                for r in my_orders
+            ]
             embed.add_field(
                 name=f"🧾 我開的團（{len(my_orders)}）",
                 value="\n".join(lines),
                 inline=False,
             )
 
-        await interaction.response.send_message(embed=embed, ephemeral=True)
+        await interaction.followup.send(embed=embed, ephemeral=True)
 
     except Exception as e:
-        await interaction.response.send_message(f"❌ 查詢失敗：{e}", ephemeral=True)
+        await interaction.followup.send(f"❌ 查詢失敗：{e}", ephemeral=True)
 
 
 # -----------------------
 # /help
 # -----------------------
-@bot.tree.command(name="help", description="顯示記帳機器人使用說明")
-async def help_cmd(interaction: discord.Interaction):
+def _build_help_embed() -> discord.Embed:
+    """說明文字是固定的：模組載入時建一次就好。"""
     embed = discord.Embed(
         title="📒 記帳機器人使用說明",
         description=(
@@ -399,7 +554,16 @@ async def help_cmd(interaction: discord.Interaction):
 
     embed.set_footer(text="這是內部記帳工具，允許人工調整。如有疑問請詢問開團者。")
 
-    await interaction.response.send_message(embed=embed, ephemeral=True)
+    return embed
+
+
+_HELP_EMBED = _build_help_embed()
+
+
+@bot.tree.command(name="help", description="顯示記帳機器人使用說明")
+async def help_cmd(interaction: discord.Interaction):
+    # 送出的是複本，避免共用的 embed 被改到
+    await interaction.response.send_message(embed=_HELP_EMBED.copy(), ephemeral=True)
 
 
 # -----------------------
@@ -414,11 +578,11 @@ async def pay_cmd(
     user: Optional[discord.Member] = None,
     paid_to: Optional[discord.Member] = None,
 ):
-    target = user or interaction.user
+    target_id = uid(user or interaction.user)
     try:
-        mark_paid(order_id=order_id, user_id=uid(target), paid_to=uid(paid_to) if paid_to else None)
+        await _db(mark_paid, order_id=order_id, user_id=target_id, paid_to=uid(paid_to) if paid_to else None)
         await interaction.response.send_message(
-            f"✅ 已標記付款：`#{order_id}` <@{uid(target)}>",
+            f"✅ 已標記付款：`#{order_id}` <@{target_id}>",
             ephemeral=False,
         )
     except Exception as e:
@@ -433,7 +597,7 @@ async def pay_cmd(
 @app_commands.describe(order_id="訂單編號", percent="折扣比例：0~1，例如 0.9 代表打九折")
 async def discount_cmd(interaction: discord.Interaction, order_id: int, percent: float):
     try:
-        set_discount_percent(order_id, percent)
+        await _db(set_discount_percent, order_id, percent)
         await interaction.response.send_message(f"✅ 已設定訂單 `#{order_id}` 折扣為 {percent}", ephemeral=False)
     except Exception as e:
         await interaction.response.send_message(f"❌ 設定失敗：{e}", ephemeral=True)
@@ -446,48 +610,15 @@ async def discount_cmd(interaction: discord.Interaction, order_id: int, percent:
 @app_commands.autocomplete(order_id=order_id_autocomplete)
 @app_commands.describe(order_id="訂單編號")
 async def lock_cmd(interaction: discord.Interaction, order_id: int):
+    me_id = uid(interaction.user)
+    # 先 ACK；單不存在 / 已作廢 / 不是開單者等錯誤由 _followup_error 私訊
+    await interaction.response.defer(ephemeral=False)
     try:
-        lock_order(order_id=order_id, actor_id=uid(interaction.user))
-
-        data = get_bill(order_id)
-        order = data["order"]
-        parts = data["participants"]
-
-        created_at = order["created_at"].replace("T", " ")[:16]
-        payer_id = order.get("payer_id", "")
-
-        embed = discord.Embed(
-            title=f"🧾 已收單 #{order['order_id']}｜{order['vendor']}",
-            description=(
-                f"📅 建立時間：**{created_at}**\n"
-                f"付款人：<@{payer_id}>\n"
-                f"狀態：**{status_text(order['status'])}**｜折扣：`{order['discount_type']} {order['discount_value']}`"
-            ),
-        )
-
-        for p in parts:
-            u = p["user_id"]
-            paid = "✅已付" if p["paid"] else "❌未付"
-
-            lines = []
-            for it in p["items"]:
-                note = f"（{it['note']}）" if it["note"] else ""
-                lines.append(f"- {it['name']} x{it['qty']} @ {it['unit_price']} = {it['line_total']} {note}")
-            if not lines:
-                lines.append("- （無品項）")
-
-            display_name = await display_name_for(interaction, u)
-            value_lines = [f"👤 <@{u}>"] + lines
-
-            embed.add_field(
-                name=f"{display_name}｜應付 {money(p['total_due'])}｜{paid}",
-                value="\n".join(value_lines),
-                inline=False,
-            )
-
-        await interaction.response.send_message(embed=embed, ephemeral=False)
+        data = await _db(lock_order_and_get_bill, order_id=order_id, actor_id=me_id)
+        embed = await _render_bill_embed(interaction, data, title_prefix="🧾 已收單", show_payer=True)
+        await interaction.followup.send(embed=embed)
     except Exception as e:
-        await interaction.response.send_message(f"❌ 收單失敗：{e}", ephemeral=True)
+        await _followup_error(interaction, f"❌ 收單失敗：{e}")
 
 
 # -----------------------
@@ -497,8 +628,9 @@ async def lock_cmd(interaction: discord.Interaction, order_id: int):
 @app_commands.autocomplete(order_id=order_id_autocomplete)
 @app_commands.describe(order_id="訂單編號")
 async def unlock_cmd(interaction: discord.Interaction, order_id: int):
+    me_id = uid(interaction.user)
     try:
-        unlock_order(order_id=order_id, actor_id=uid(interaction.user))
+        await _db(unlock_order, order_id=order_id, actor_id=me_id)
         await interaction.response.send_message(
             f"🔓 已解鎖訂單：`#{order_id}`（此單重新開放加品項）",
             ephemeral=False,
@@ -514,8 +646,9 @@ async def unlock_cmd(interaction: discord.Interaction, order_id: int):
 @app_commands.autocomplete(order_id=order_id_autocomplete)
 @app_commands.describe(order_id="訂單編號")
 async def cancel_cmd(interaction: discord.Interaction, order_id: int):
+    me_id = uid(interaction.user)
     try:
-        cancel_order(order_id=order_id, actor_id=uid(interaction.user))
+        await _db(cancel_order, order_id=order_id, actor_id=me_id)
         await interaction.response.send_message(
             f"🗑️ 已作廢訂單：`#{order_id}`（此單不再計入欠款與結算）",
             ephemeral=False,
@@ -532,41 +665,102 @@ async def on_ready():
 # Safe math evaluator
 # -----------------------
 
-_ALLOWED_OPERATORS = {
-    ast.Add: operator.add,
-    ast.Sub: operator.sub,
-    ast.Mult: operator.mul,
-    ast.Div: operator.truediv,
-    ast.USub: operator.neg,
+# 只允許四則運算字元：把這些 byte 刪掉後還有剩就不是算式（C 層級批次處理，不跑 regex）
+_MATH_CHARS = b"0123456789+-*/(). "
+_MATH_MAX_LEN = 256
+# 數字 或 運算子/括號；前面允許空白
+_TOKEN_RE = re.compile(r"\s*(?:(\d+\.?\d*|\.\d+)|([+\-*/()]))")
+
+# 運算子 → (運算元個數, 實作)；"u" = 一元負號
+_OPS = {
+    "+": (2, operator.add),
+    "-": (2, operator.sub),
+    "*": (2, operator.mul),
+    "/": (2, operator.truediv),
+    "u": (1, operator.neg),
 }
+# 一元負號優先序最高
+_PREC = {"+": 1, "-": 1, "*": 2, "/": 2, "u": 3}
 
-def safe_eval(expr: str) -> float:
+
+def _apply(op: str, vals: list) -> None:
+    arity, fn = _OPS[op]
+    if len(vals) < arity:
+        raise ValueError("Invalid expression")
+    args = vals[-arity:]
+    del vals[-arity:]
+    vals.append(fn(*args))
+
+
+def _safe_eval_uncached(expr: str) -> float:
     """
-    安全的四則運算 evaluator
+    安全的四則運算 evaluator（shunting-yard，不經過 Python parser）
     只允許 + - * / () 小數
     """
-    def _eval(node):
-        if isinstance(node, ast.Expression):
-            return _eval(node.body)
-        elif isinstance(node, ast.BinOp):
-            op = _ALLOWED_OPERATORS.get(type(node.op))
-            if not op:
-                raise ValueError("Unsupported operator")
-            return op(_eval(node.left), _eval(node.right))
-        elif isinstance(node, ast.UnaryOp):
-            op = _ALLOWED_OPERATORS.get(type(node.op))
-            if not op:
+    vals: list = []
+    ops: list[str] = []
+    expect_operand = True  # 下一個 token 應該是數字 / "(" / 一元負號
+
+    pos = 0
+    end = len(expr.rstrip())
+    while pos < end:
+        m = _TOKEN_RE.match(expr, pos)
+        if not m:
+            raise ValueError("Invalid token")
+        pos = m.end()
+        num, tok = m.groups()
+
+        if num is not None:
+            if not expect_operand:
+                raise ValueError("Invalid expression")
+            vals.append(float(num) if "." in num else int(num))
+            expect_operand = False
+        elif tok == "(":
+            if not expect_operand:
+                raise ValueError("Invalid expression")
+            ops.append(tok)
+        elif tok == ")":
+            if expect_operand:
+                raise ValueError("Invalid expression")
+            while ops and ops[-1] != "(":
+                _apply(ops.pop(), vals)
+            if not ops:
+                raise ValueError("Unbalanced parentheses")
+            ops.pop()
+        elif expect_operand:
+            # 只支援一元負號（跟原本 ast 版一樣）
+            if tok != "-":
                 raise ValueError("Unsupported unary operator")
-            return op(_eval(node.operand))
-        elif isinstance(node, ast.Constant):
-            if isinstance(node.value, (int, float)):
-                return node.value
-            raise ValueError("Invalid constant")
+            ops.append("u")
         else:
-            raise ValueError("Invalid expression")
+            prec = _PREC[tok]
+            while ops and ops[-1] != "(" and _PREC[ops[-1]] >= prec:
+                _apply(ops.pop(), vals)
+            ops.append(tok)
+            expect_operand = True
+
+    if expect_operand:
+        raise ValueError("Invalid expression")
+    while ops:
+        op = ops.pop()
+        if op == "(":
+            raise ValueError("Unbalanced parentheses")
+        _apply(op, vals)
+    if len(vals) != 1:
+        raise ValueError("Invalid expression")
+    return vals[0]
+
 
-    tree = ast.parse(expr, mode="eval")
-    return _eval(tree)
+# 聊天常重複算同一題（例如 help 裡的範例），純函式可以直接快取結果
+_SAFE_EVAL_CACHE_MAX_LEN = 128
+_cached_safe_eval = lru_cache(maxsize=512)(_safe_eval_uncached)
+
+
+def safe_eval(expr: str) -> float:
+    # 太長的算式不進快取，避免把快取塞滿
+    if len(expr) > _SAFE_EVAL_CACHE_MAX_LEN:
+        return _safe_eval_uncached(expr)
+    return _cached_safe_eval(expr)
 
 # -----------------------
 # Chat math handler
@@ -576,21 +770,23 @@ async def on_message(message: discord.Message):
     if message.author.bot:
         return
 
-    text = message.content.strip()
-
-    # 必須以 "=" 結尾
-    if text.endswith("="):
-        expr = text[:-1].strip()
-
-        # 只允許四則運算字元
-        if re.fullmatch(r"[0-9+\-*/(). ]+", expr):
-            try:
-                result = safe_eval(expr)
-                if isinstance(result, float) and result.is_integer():
-                    result = int(result)
-                await message.channel.send(f"= {result}")
-            except Exception:
-                pass
+    # 必須以 "=" 結尾（大部分訊息在這裡就結束，不用先 strip）
+    # 算式頂多幾十個字，太長的（貼 code / log）直接略過
+    content = message.content
+    if len(content) > _MATH_MAX_LEN or not content.endswith("="):
+        return
+
+    expr = content[:-1].strip()
+    if not expr or not expr.isascii() or expr.encode("ascii").translate(None, _MATH_CHARS):
+        return
+
+    try:
+        result = safe_eval(expr)
+        if isinstance(result, float) and result.is_integer():
+            result = int(result)
+        await message.channel.send(f"= {result}")
+    except Exception:
+        pass
 
 
 if __name__ == "__main__":
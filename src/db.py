@@ -1,10 +1,17 @@
 from __future__ import annotations
 
+import atexit
+import logging
 import sqlite3
+import threading
+from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterator, List, NoReturn, Optional, Tuple
+
+
+log = logging.getLogger(__name__)
 
 
 # ---------- Paths ----------
@@ -12,19 +19,172 @@ ROOT = Path(__file__).resolve().parents[1]
 DB_PATH = ROOT / "db" / "app.sqlite3"
 
 
-def now_iso() -> str:
-    # SQLite 用 TEXT 存 ISO8601，簡單又好用
-    return datetime.now().isoformat(timespec="seconds")
+# 每條連線開啟時設一次（都是 idempotent）
+_PRAGMAS = (
+    "PRAGMA foreign_keys = ON;",
+    "PRAGMA journal_mode = WAL;",
+    "PRAGMA synchronous = NORMAL;",  # WAL 下不會因當機壞檔，commit 不用每次 fsync
+    "PRAGMA busy_timeout = 5000;",  # 讀寫撞到時等 5 秒，而不是直接 SQLITE_BUSY
+    "PRAGMA cache_size = -20000;",  # 約 20 MB page cache
+    "PRAGMA mmap_size = 268435456;",  # 256 MB mmap，熱資料直接從記憶體讀
+    "PRAGMA temp_store = MEMORY;",
+    "PRAGMA wal_autocheckpoint = 1000;",
+)
+# 唯讀連線不能改 journal_mode / checkpoint 設定，只設讀取相關的
+_READER_PRAGMAS = (
+    "PRAGMA busy_timeout = 5000;",
+    "PRAGMA cache_size = -20000;",
+    "PRAGMA mmap_size = 268435456;",
+    "PRAGMA temp_store = MEMORY;",
+)
+
+# 連線都是長駐的：PRAGMA 只跑一次、page cache 也能留著
+# - 寫入：全程式共用一條，用 _WRITE_LOCK 保證同時只有一個 writer
+# - 讀取：每個 thread 一條唯讀連線，WAL 下讀不會被寫擋住
+_TLS = threading.local()
+_WRITE_LOCK = threading.RLock()
+_writer: Optional[sqlite3.Connection] = None
+# batch() 巢狀深度：只在拿著 _WRITE_LOCK 時讀寫（RLock 的 owner 才會巢狀進來）
+_batch_depth = 0
+_ALL_CONNS: List[sqlite3.Connection] = []
+_ALL_CONNS_LOCK = threading.Lock()
+
+
+def connect(readonly: bool = False) -> sqlite3.Connection:
+    """
+    開一條新的、設好 PRAGMA 的連線（平常請用 batch() / _reader_conn()，它們會重用連線）。
+    連線是 autocommit（isolation_level=None）：transaction 一律由 batch() 控制。
+    """
+    # check_same_thread=False：writer 會被不同 thread 輪流用（有 lock 保護），atexit 也要能關
+    # cached_statements：SQL 都是固定字串，放大 prepared statement 快取讓每條都只 parse 一次
+    if readonly:
+        conn = sqlite3.connect(
+            f"{DB_PATH.as_uri()}?mode=ro",
+            uri=True,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=256,
+        )
+    else:
+        conn = sqlite3.connect(
+            DB_PATH,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=256,
+        )
+    conn.row_factory = sqlite3.Row
+    for pragma in _READER_PRAGMAS if readonly else _PRAGMAS:
+        conn.execute(pragma)
+    with _ALL_CONNS_LOCK:
+        _ALL_CONNS.append(conn)
+    return conn
+
 
+def _writer_conn() -> sqlite3.Connection:
+    global _writer
+    with _WRITE_LOCK:
+        if _writer is None:
+            _writer = connect()
+        return _writer
 
-def connect() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON;")
-    conn.execute("PRAGMA journal_mode = WAL;")
+
+def _reader_conn() -> sqlite3.Connection:
+    conn = getattr(_TLS, "reader", None)
+    if conn is None:
+        # 先確保 writer 開著：它讓 -wal/-shm 一直存在，唯讀連線才開得起來
+        _writer_conn()
+        conn = _TLS.reader = connect(readonly=True)
     return conn
 
 
+@contextmanager
+def batch() -> Iterator[sqlite3.Connection]:
+    """
+    把多個寫入包成同一個 transaction（BEGIN IMMEDIATE … COMMIT，只 fsync 一次）：
+
+        with batch():
+            add_item(...)
+            add_item(...)
+
+    已經在 batch 裡的話沿用外層 transaction，內層包成 SAVEPOINT：
+    內層出錯只撤回內層自己的寫入（跟單獨呼叫時一樣是原子的），最後由最外層 commit。
+    注意：get_user_debt 等查詢走唯讀連線，commit 前看不到 batch 裡的寫入。
+    """
+    global _batch_depth
+    with _WRITE_LOCK:
+        conn = _writer_conn()
+        if _batch_depth > 0:  # 拿著 lock 的只有自己，所以這一定是自己外層的 batch
+            _batch_depth += 1
+            savepoint = f"batch_{_batch_depth}"
+            conn.execute(f"SAVEPOINT {savepoint}")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute(f"ROLLBACK TO {savepoint}")
+                conn.execute(f"RELEASE {savepoint}")
+                raise
+            else:
+                conn.execute(f"RELEASE {savepoint}")
+            finally:
+                _batch_depth -= 1
+            return
+
+        if conn.in_transaction:
+            # 不在任何 batch 裡卻還在 transaction：之前的 COMMIT/ROLLBACK 失敗留下來的，不能沿用
+            log.warning("writer 連線殘留未結束的 transaction，先 ROLLBACK")
+            conn.execute("ROLLBACK")
+
+        conn.execute("BEGIN IMMEDIATE")
+        _batch_depth = 1
+        try:
+            yield conn
+        except BaseException:
+            _rollback(conn)
+            raise
+        else:
+            try:
+                conn.execute("COMMIT")
+            except BaseException:
+                _rollback(conn)
+                raise
+        finally:
+            _batch_depth = 0
+
+
+def _rollback(conn: sqlite3.Connection) -> None:
+    # ROLLBACK 本身也可能失敗（例如 I/O error）；不蓋掉原本的例外，下次 batch() 進來會再清一次
+    try:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+    except sqlite3.Error as e:
+        log.warning("ROLLBACK 失敗：%s", e)
+
+
+def optimize() -> None:
+    """
+    PRAGMA optimize：只重新 ANALYZE 統計過期的表，通常很快。
+    長駐的 bot 每隔幾小時呼叫一次（bot.py 有排程），程式結束時也會跑一次。
+    """
+    with _WRITE_LOCK:
+        _writer_conn().execute("PRAGMA optimize;")
+
+
+@atexit.register
+def _close_connections() -> None:
+    # 關之前讓 writer 更新一次統計（唯讀連線寫不了 sqlite_stat1，所以只跑 writer）
+    if _writer is not None:
+        try:
+            with _WRITE_LOCK:
+                _writer.execute("PRAGMA optimize;")
+        except sqlite3.Error:
+            pass
+    with _ALL_CONNS_LOCK:
+        # 反過來關：writer 通常最早開、最後關，才能做最後的 checkpoint、清掉 -wal/-shm
+        for conn in reversed(_ALL_CONNS):
+            conn.close()
+        _ALL_CONNS.clear()
+
+
 # ---------- Data models ----------
 @dataclass
 class LineItem:
@@ -51,16 +211,15 @@ def create_order(
     if not payer_id:
         payer_id = creator_id
 
-    with connect() as conn:
+    with batch() as conn:
         cur = conn.execute(
             """
-            INSERT INTO orders (created_at, vendor, note, creator_id, payer_id, discount_type, discount_value, status)
-            VALUES (?, ?, ?, ?, ?, 'none', 0, 'open')
+            INSERT INTO orders (created_at, vendor, note, creator_id, payer_id, discount_type, discount_bps, status)
+            VALUES (strftime('%Y-%m-%dT%H:%M:%S', 'now', 'localtime'), ?, ?, ?, ?, 'none', 0, 'open')
             """,
-            (now_iso(), vendor, note, creator_id, payer_id),
+            (vendor, note, creator_id, payer_id),
         )
         order_id = int(cur.lastrowid)
-        conn.commit()
         return order_id
 
 
@@ -76,31 +235,52 @@ def add_item(
     """
     新增一筆品項，回傳 item_id。新增後會自動 recalc_order。
     """
-    if created_by is None:
-        created_by = user_id
+    return add_items(order_id, [(user_id, name, unit_price, qty, note, created_by)])[0]
 
-    if qty <= 0:
-        raise ValueError("qty 必須 > 0")
-    if unit_price < 0:
-        raise ValueError("unit_price 必須 >= 0")
 
-    with connect() as conn:
-        _ensure_order_editable(conn, order_id)
-
-        cur = conn.execute(
+def add_items(
+    order_id: int,
+    rows: List[Tuple[str, str, int, int, str, Optional[str]]],
+) -> List[int]:
+    """
+    一次新增多筆品項，回傳 item_id 清單（順序同 rows）。
+    rows 每筆為 (user_id, name, unit_price, qty, note, created_by)；created_by 為 None 時等於 user_id。
+    全部寫入後只 recalc 一次、commit 一次。
+    """
+    for _, _, unit_price, qty, _, _ in rows:
+        if qty <= 0:
+            raise ValueError("qty 必須 > 0")
+        if unit_price < 0:
+            raise ValueError("unit_price 必須 >= 0")
+    if not rows:
+        return []
+
+    # SQL 的 'now' 只在單次 step 內固定，executemany 每列都 step 一次：
+    # 這裡取一次時間綁進每一列，整批品項的 created_at 才會一樣（格式同 SQL 端的 strftime）
+    created_at = datetime.now().isoformat(timespec="seconds")
+    params = [
+        (order_id, user_id, name, unit_price, qty, note, created_at, user_id if created_by is None else created_by)
+        for user_id, name, unit_price, qty, note, created_by in rows
+    ]
+
+    with batch() as conn:
+        # 「訂單可編輯」直接寫在 INSERT 條件裡：一條 SQL 同時檢查 + 寫入
+        cur = conn.executemany(
             """
             INSERT INTO line_items (order_id, user_id, name, unit_price, qty, note, created_at, created_by)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            SELECT ?, ?, ?, ?, ?, ?, ?, ?
+            WHERE (SELECT status FROM orders WHERE order_id=?) NOT IN ('locked', 'cancelled')
             """,
-            (order_id, user_id, name, unit_price, qty, note, now_iso(), created_by),
+            [p + (order_id,) for p in params],
         )
-        item_id = int(cur.lastrowid)
+        if cur.rowcount == 0:
+            _raise_not_editable(conn, order_id)
+        # 同一個 transaction 且只有一個 writer：這批 item_id 一定連號
+        last_id = int(conn.execute("SELECT last_insert_rowid()").fetchone()[0])
 
         # 重新計算 participants.total_due
         recalc_order_conn(conn, order_id)
-
-        conn.commit()
-        return item_id
+        return list(range(last_id - len(params) + 1, last_id + 1))
 
 
 def set_discount_percent(order_id: int, percent: float) -> None:
@@ -111,41 +291,38 @@ def set_discount_percent(order_id: int, percent: float) -> None:
     if not (0 <= percent <= 1.0):
         raise ValueError("percent 必須在 0 ~ 1 之間，例如 0.9")
 
-    with connect() as conn:
-        _ensure_order_editable(conn, order_id)
-
-        conn.execute(
+    with batch() as conn:
+        cur = conn.execute(
             """
             UPDATE orders
-            SET discount_type='percent', discount_value=?
-            WHERE order_id=?
+            SET discount_type='percent', discount_bps=?
+            WHERE order_id=? AND status NOT IN ('locked', 'cancelled')
             """,
-            (percent, order_id),
+            (int(round(percent * 10000)), order_id),
         )
+        if cur.rowcount == 0:
+            _raise_not_editable(conn, order_id)
         recalc_order_conn(conn, order_id)
-        conn.commit()
 
 def set_adjustment(order_id: int, adjustment: int, actor_id: str) -> None:
     """
     設定「每人矯正金額」（可正可負），僅開單者可用。
     計算順序：先 discount，再 adjustment（在 recalc_order_conn 內處理）。
     """
-    with connect() as conn:
-        order = _get_order_row(conn, order_id)
-
-        if order["status"] == "cancelled":
-            raise ValueError("此訂單已作廢，不能設定矯正。")
-        if order["creator_id"] != actor_id:
-            raise ValueError("只有開單的人可以設定矯正金額。")
-
-        conn.execute(
-            "UPDATE orders SET adjustment=? WHERE order_id=?",
-            (int(adjustment), int(order_id)),
+    with batch() as conn:
+        cur = conn.execute(
+            "UPDATE orders SET adjustment=? WHERE order_id=? AND status != 'cancelled' AND creator_id=?",
+            (int(adjustment), int(order_id), actor_id),
         )
+        if cur.rowcount == 0:
+            # 沒更新到：查一次看是哪個條件不符
+            order = _get_order_row(conn, order_id)
+            if order["status"] == "cancelled":
+                raise ValueError("此訂單已作廢，不能設定矯正。")
+            raise ValueError("只有開單的人可以設定矯正金額。")
 
         # 重新計算 participants.total_due
         recalc_order_conn(conn, order_id)
-        conn.commit()
 
 
 def cancel_order(order_id: int, actor_id: str) -> None:
@@ -153,7 +330,7 @@ def cancel_order(order_id: int, actor_id: str) -> None:
     作廢整張單（status=cancelled），僅開單者可用。
     cancelled 單不計入 /debt，且不可再修改/解鎖。
     """
-    with connect() as conn:
+    with batch() as conn:
         order = _get_order_row(conn, order_id)
 
         if order["status"] == "cancelled":
@@ -162,116 +339,83 @@ def cancel_order(order_id: int, actor_id: str) -> None:
             raise ValueError("只有開單的人可以作廢此訂單。")
 
         conn.execute("UPDATE orders SET status='cancelled' WHERE order_id=?", (order_id,))
-        conn.commit()
 
 
 def mark_paid(order_id: int, user_id: str, paid_to: Optional[str] = None) -> None:
     """
     將某人在某張單標記為已付。
     """
-    with connect() as conn:
-        # 如果 participants 還沒建立，先 recalc 會建立
-        recalc_order_conn(conn, order_id)
+    # paid_to 沒給就用訂單 payer；RETURNING 拿不到列 = 這人不在 participants
+    sql = """
+        UPDATE participants
+        SET paid=1, paid_at=strftime('%Y-%m-%dT%H:%M:%S', 'now', 'localtime'),
+            paid_to=COALESCE(?, (SELECT payer_id FROM orders WHERE order_id=?))
+        WHERE order_id=? AND user_id=?
+        RETURNING 1
+    """
 
-        payer_id = conn.execute(
-            "SELECT payer_id FROM orders WHERE order_id=?",
-            (order_id,),
-        ).fetchone()
-        if payer_id is None:
-            raise ValueError(f"找不到 order_id={order_id}")
-        default_paid_to = payer_id["payer_id"]
-        if paid_to is None:
-            paid_to = default_paid_to
-
-        # 先確認這個人有在 participants
-        row = conn.execute(
-            "SELECT total_due, paid FROM participants WHERE order_id=? AND user_id=?",
-            (order_id, user_id),
-        ).fetchone()
+    params = (paid_to, order_id, order_id, user_id)
+
+    with batch() as conn:
+        row = conn.execute(sql, params).fetchone()
+        if row is None:
+            # 少見：participants 還沒建立，先 recalc 會建立（訂單不存在也會在這裡報錯）
+            recalc_order_conn(conn, order_id)
+            row = conn.execute(sql, params).fetchone()
         if row is None:
             raise ValueError("這個 user 在此單沒有任何品項，無法付款。")
 
-        conn.execute(
-            """
-            UPDATE participants
-            SET paid=1, paid_at=?, paid_to=?
-            WHERE order_id=? AND user_id=?
-            """,
-            (now_iso(), paid_to, order_id, user_id),
-        )
-        conn.commit()
-
 
 # ---------- Queries ----------
 def get_bill(order_id: int) -> Dict[str, Any]:
     """
     取得整張單的帳單資料：
     - order metadata
-    - 每個人的品項清單、subtotal、total_due、paid
+    - 每個人的品項清單（sqlite3.Row）、subtotal、total_due、paid
     """
-    with connect() as conn:
-        order = conn.execute(
-            "SELECT * FROM orders WHERE order_id=?",
-            (order_id,),
-        ).fetchone()
-        if order is None:
-            raise ValueError(f"找不到 order_id={order_id}")
-
-        # 確保 participants 是最新的
-        recalc_order_conn(conn, order_id)
-
-        items = conn.execute(
-            """
-            SELECT item_id, order_id, user_id, name, unit_price, qty, note
-            FROM line_items
-            WHERE order_id=?
-            ORDER BY user_id, item_id
-            """,
-            (order_id,),
-        ).fetchall()
+    # participants 在每次寫入（add_item / 折扣 / 矯正）時都已 recalc，這裡純讀
+    return _get_bill_conn(_reader_conn(), order_id)
 
-        parts = conn.execute(
-            """
-            SELECT order_id, user_id, total_due, paid, paid_at, COALESCE(paid_to, '') AS paid_to
-            FROM participants
-            WHERE order_id=?
-            ORDER BY user_id
-            """,
-            (order_id,),
-        ).fetchall()
 
-    # 組合資料（不在 conn 內做太多）
-    by_user_items: Dict[str, List[Dict[str, Any]]] = {}
-    for r in items:
-        by_user_items.setdefault(r["user_id"], []).append(
-            {
-                "name": r["name"],
-                "unit_price": r["unit_price"],
-                "qty": r["qty"],
-                "note": r["note"],
-                "line_total": int(r["unit_price"]) * int(r["qty"]),
-            }
-        )
+def _get_bill_conn(conn: sqlite3.Connection, order_id: int) -> Dict[str, Any]:
+    order = conn.execute(
+        "SELECT * FROM orders WHERE order_id=?",
+        (order_id,),
+    ).fetchone()
+    if order is None:
+        raise ValueError(f"找不到 order_id={order_id}")
 
-    # subtotal per user
-    subtotals: Dict[str, int] = {
-        uid: sum(x["line_total"] for x in its) for uid, its in by_user_items.items()
-    }
+    # 每人 × 品項一列（participants LEFT JOIN line_items）；subtotal / line_total 都是存好的欄位
+    rows = conn.execute(
+        """
+        SELECT p.user_id, p.subtotal, p.total_due, p.paid, p.paid_at, COALESCE(p.paid_to, '') AS paid_to,
+               li.name, li.unit_price, li.qty, li.note, li.line_total
+        FROM participants p
+        LEFT JOIN line_items li ON li.order_id = p.order_id AND li.user_id = p.user_id
+        WHERE p.order_id=?
+        ORDER BY p.user_id, li.item_id
+        """,
+        (order_id,),
+    ).fetchall()
 
+    # 組合資料：rows 已依 user_id 排好，一次掃過分組
     participants: List[Dict[str, Any]] = []
-    for p in parts:
-        uid = p["user_id"]
-        participants.append(
-            {
-                "user_id": uid,
-                "subtotal": subtotals.get(uid, 0),
-                "total_due": int(p["total_due"]),
-                "paid": bool(p["paid"]),
-                "paid_at": p["paid_at"],
-                "paid_to": p["paid_to"],
-                "items": by_user_items.get(uid, []),
+    current: Optional[Dict[str, Any]] = None
+    for r in rows:
+        if current is None or current["user_id"] != r["user_id"]:
+            current = {
+                "user_id": r["user_id"],
+                "subtotal": r["subtotal"],
+                "total_due": int(r["total_due"]),
+                "paid": bool(r["paid"]),
+                "paid_at": r["paid_at"],
+                "paid_to": r["paid_to"],
+                "items": [],
             }
-        )
+            participants.append(current)
+        if r["name"] is not None:  # LEFT JOIN 沒對到品項
+            # 品項直接放 sqlite3.Row（name / unit_price / qty / note / line_total 用 key 取），不另外組 dict
+            current["items"].append(r)
 
     return {
         "order": dict(order),
@@ -283,20 +427,20 @@ def get_user_debt(user_id: str) -> Dict[str, Any]:
     """
     查某人目前未付清總欠款與明細（忽略 cancelled 單）。
     """
-    with connect() as conn:
-        rows = conn.execute(
-            """
-            SELECT o.order_id, o.vendor, o.created_at, o.payer_id,
-                   p.total_due, p.paid
-            FROM participants p
-            JOIN orders o ON o.order_id = p.order_id
-            WHERE p.user_id=?
-              AND o.status != 'cancelled'
-              AND p.paid = 0
-            ORDER BY o.created_at DESC
-            """,
-            (user_id,),
-        ).fetchall()
+    conn = _reader_conn()
+    rows = conn.execute(
+        """
+        SELECT o.order_id, o.vendor, o.created_at, o.payer_id,
+               p.total_due, p.paid
+        FROM participants p
+        JOIN orders o ON o.order_id = p.order_id
+        WHERE p.user_id=?
+          AND o.status != 'cancelled'
+          AND p.paid = 0
+        ORDER BY o.created_at DESC
+        """,
+        (user_id,),
+    ).fetchall()
 
     details = []
     total = 0
@@ -320,12 +464,17 @@ def get_user_overview(user_id: str, limit: int = 10) -> Dict[str, Any]:
     """
     個人總覽：
     - unpaid：未付清的訂單（忽略 cancelled）
+    - unpaid_total：上面 unpaid 幾筆的應付合計
     - paid_recent：最近已付清的訂單（忽略 cancelled）
     - my_orders：我開的訂單（忽略 cancelled）
+    清單直接回傳 sqlite3.Row（可用 r["欄位"] 取值），不另外轉 dict。
     """
-    with connect() as conn:
-        unpaid_rows = conn.execute(
-            """
+    conn = _reader_conn()
+    # 合計（顯示的這幾筆）直接在同一個 query 用 window function 算
+    unpaid_rows = conn.execute(
+        """
+        SELECT u.*, SUM(u.total_due) OVER () AS unpaid_total
+        FROM (
             SELECT o.order_id, o.vendor, o.created_at, o.status, o.payer_id,
                    p.total_due, p.paid
             FROM participants p
@@ -335,74 +484,78 @@ def get_user_overview(user_id: str, limit: int = 10) -> Dict[str, Any]:
               AND p.paid = 0
             ORDER BY o.created_at DESC
             LIMIT ?
-            """,
-            (user_id, limit),
-        ).fetchall()
+        ) AS u
+        ORDER BY u.created_at DESC
+        """,
+        (user_id, limit),
+    ).fetchall()
 
-        paid_rows = conn.execute(
-            """
-            SELECT o.order_id, o.vendor, o.created_at, o.status, o.payer_id,
-                   p.total_due, p.paid_at
-            FROM participants p
-            JOIN orders o ON o.order_id = p.order_id
-            WHERE p.user_id=?
-              AND o.status != 'cancelled'
-              AND p.paid = 1
-            ORDER BY p.paid_at DESC, o.created_at DESC
-            LIMIT ?
-            """,
-            (user_id, limit),
-        ).fetchall()
+    paid_rows = conn.execute(
+        """
+        SELECT o.order_id, o.vendor, o.created_at, o.status, o.payer_id,
+               p.total_due, p.paid_at
+        FROM participants p
+        JOIN orders o ON o.order_id = p.order_id
+        WHERE p.user_id=?
+          AND o.status != 'cancelled'
+          AND p.paid = 1
+        ORDER BY p.paid_at DESC, o.created_at DESC
+        LIMIT ?
+        """,
+        (user_id, limit),
+    ).fetchall()
 
-        my_orders = conn.execute(
-            """
+    # 先取最近 limit 張單，再跟 participants JOIN 一次算人數與總額
+    # （participants 每次寫入都會 recalc：有品項的人 = participants 的人）
+    my_orders = conn.execute(
+        """
+        WITH mine AS (
             SELECT o.order_id, o.vendor, o.created_at, o.status, o.payer_id,
-                   o.discount_type, o.discount_value,
-                   (SELECT COUNT(DISTINCT li.user_id)
-                      FROM line_items li
-                     WHERE li.order_id = o.order_id) AS people_count,
-                   (SELECT COALESCE(SUM(p.total_due), 0)
-                      FROM participants p
-                     WHERE p.order_id = o.order_id) AS total_after_discount
+                   o.discount_type, o.discount_value
             FROM orders o
             WHERE o.creator_id=?
               AND o.status != 'cancelled'
             ORDER BY o.created_at DESC
             LIMIT ?
-            """,
-            (user_id, limit),
-        ).fetchall()
-
-    def row_to_dict(r):
-        return {k: r[k] for k in r.keys()}
+        )
+        SELECT m.*,
+               COUNT(p.user_id) AS people_count,
+               COALESCE(SUM(p.total_due), 0) AS total_after_discount
+        FROM mine m
+        LEFT JOIN participants p ON p.order_id = m.order_id
+        GROUP BY m.order_id
+        ORDER BY m.created_at DESC
+        """,
+        (user_id, limit),
+    ).fetchall()
 
     return {
         "user_id": user_id,
-        "unpaid": [row_to_dict(r) for r in unpaid_rows],
-        "paid_recent": [row_to_dict(r) for r in paid_rows],
-        "my_orders": [row_to_dict(r) for r in my_orders],
+        "unpaid": unpaid_rows,
+        "unpaid_total": int(unpaid_rows[0]["unpaid_total"] or 0) if unpaid_rows else 0,
+        "paid_recent": paid_rows,
+        "my_orders": my_orders,
     }
 
 
 # ---------- Recalculation ----------
 def recalc_order(order_id: int) -> None:
-    with connect() as conn:
+    with batch() as conn:
         recalc_order_conn(conn, order_id)
-        conn.commit()
 
 
 def recalc_order_conn(conn: sqlite3.Connection, order_id: int) -> None:
     """
     重新計算 participants.total_due（在同一個 conn/transaction 裡）。
     MVP 規則：
-      - subtotal = Σ(unit_price*qty) per user
+      - subtotal = Σ line_total per user（也寫回 participants.subtotal）
       - discount none: total_due=subtotal
-      - discount percent: total_due=round(subtotal*percent)
+      - discount percent: total_due=round(subtotal*percent)（用 discount_bps 整數運算，.5 進位）
       - adjustment: total_due=total_due+adjustment (每人固定加減)
       - cancelled: 不處理（但保留資料）
     """
     order = conn.execute(
-        "SELECT status, discount_type, discount_value, adjustment FROM orders WHERE order_id=?",
+        "SELECT status, discount_type, discount_bps, adjustment FROM orders WHERE order_id=?",
         (order_id,),
     ).fetchone()
     if order is None:
@@ -411,50 +564,34 @@ def recalc_order_conn(conn: sqlite3.Connection, order_id: int) -> None:
     if order["status"] == "cancelled":
         return  # 作廢單不再更新（也不計入欠款）
 
-    # 計算每人 subtotal
-    rows = conn.execute(
+    # 每人 subtotal → 折扣 → 矯正，整段在 SQL 裡一次 upsert（不把資料拉回 Python）
+    #   - percent：(subtotal*bps + 5000) / 10000，純整數四捨五入，不經過浮點數
+    #   - amount：先不做（避免規則不清晰造成爭議），跟 none 一樣用 subtotal
+    # 若已付，不動 total_due 也可以，但通常改折扣後已付者也應該一致更新
+    # 這裡我們照「更新 total_due，但保留 paid 狀態」
+    conn.execute(
         """
-        SELECT user_id, SUM(unit_price * qty) AS subtotal
+        INSERT INTO participants (order_id, user_id, subtotal, total_due, paid, paid_at, paid_to)
+        SELECT order_id, user_id,
+               SUM(line_total),
+               MAX(0, CASE :discount_type
+                        WHEN 'percent' THEN (SUM(line_total) * :discount_bps + 5000) / 10000
+                        ELSE SUM(line_total)
+                      END + :adjustment),
+               0, NULL, NULL
         FROM line_items
-        WHERE order_id=?
+        WHERE order_id = :order_id
         GROUP BY user_id
+        ON CONFLICT(order_id, user_id)
+        DO UPDATE SET subtotal=excluded.subtotal, total_due=excluded.total_due
         """,
-        (order_id,),
-    ).fetchall()
-
-    subtotals = {r["user_id"]: int(r["subtotal"] or 0) for r in rows}
-
-    discount_type = order["discount_type"]
-    discount_value = float(order["discount_value"])
-    adjustment = int(order["adjustment"] or 0)
-
-    def calc_total(subtotal: int) -> int:
-        if discount_type == "none":
-            return subtotal
-        if discount_type == "percent":
-            # round() 在 .5 會走 bankers rounding；MVP 可接受
-            return int(round(subtotal * discount_value))
-        if discount_type == "amount":
-            # 先不做：避免規則不清晰造成爭議
-            # 你要做時我可以幫你加「按比例分攤」版本
-            return subtotal
-        return subtotal
-
-    # upsert participants
-    for uid, subtotal in subtotals.items():
-        total_due = max(0, calc_total(subtotal) + adjustment)
-
-        # 若已付，不動 total_due 也可以，但通常改折扣後已付者也應該一致更新
-        # 這裡我們照「更新 total_due，但保留 paid 狀態」
-        conn.execute(
-            """
-            INSERT INTO participants (order_id, user_id, total_due, paid, paid_at, paid_to)
-            VALUES (?, ?, ?, 0, NULL, NULL)
-            ON CONFLICT(order_id, user_id)
-            DO UPDATE SET total_due=excluded.total_due
-            """,
-            (order_id, uid, total_due),
-        )
+        {
+            "order_id": order_id,
+            "discount_type": order["discount_type"],
+            "discount_bps": int(order["discount_bps"]),
+            "adjustment": int(order["adjustment"] or 0),
+        },
+    )
 
     # 清掉「已經沒有品項的人」的 participants（避免殘留）
     conn.execute(
@@ -470,15 +607,15 @@ def recalc_order_conn(conn: sqlite3.Connection, order_id: int) -> None:
 
 
 # ---------- Helpers ----------
-def _ensure_order_editable(conn: sqlite3.Connection, order_id: int) -> None:
+def _raise_not_editable(conn: sqlite3.Connection, order_id: int) -> NoReturn:
+    """條件式寫入沒寫到任何列時呼叫：查一次看是找不到單還是單已鎖定/作廢。"""
     row = conn.execute(
         "SELECT status FROM orders WHERE order_id=?",
         (order_id,),
     ).fetchone()
     if row is None:
         raise ValueError(f"找不到 order_id={order_id}")
-    if row["status"] in ("locked", "cancelled"):
-        raise ValueError("此訂單已鎖定或作廢，不能修改。")
+    raise ValueError("此訂單已鎖定或作廢，不能修改。")
 
 
 def _get_order_row(conn: sqlite3.Connection, order_id: int) -> sqlite3.Row:
@@ -490,21 +627,32 @@ def _get_order_row(conn: sqlite3.Connection, order_id: int) -> sqlite3.Row:
 
 def lock_order(order_id: int, actor_id: str) -> None:
     """收單：將訂單狀態設為 locked（僅開單者可用）。"""
-    with connect() as conn:
-        order = _get_order_row(conn, order_id)
+    with batch() as conn:
+        _lock_order_conn(conn, order_id, actor_id)
+
+
+def lock_order_and_get_bill(order_id: int, actor_id: str) -> Dict[str, Any]:
+    """收單並回傳收單後的帳單（同一個 conn/transaction，格式同 get_bill）。"""
+    with batch() as conn:
+        _lock_order_conn(conn, order_id, actor_id)
+        data = _get_bill_conn(conn, order_id)
+        return data
 
-        if order["status"] == "cancelled":
-            raise ValueError("此訂單已作廢，不能收單。")
-        if order["creator_id"] != actor_id:
-            raise ValueError("只有開單的人可以收單。")
 
-        conn.execute("UPDATE orders SET status='locked' WHERE order_id=?", (order_id,))
-        conn.commit()
+def _lock_order_conn(conn: sqlite3.Connection, order_id: int, actor_id: str) -> None:
+    order = _get_order_row(conn, order_id)
+
+    if order["status"] == "cancelled":
+        raise ValueError("此訂單已作廢，不能收單。")
+    if order["creator_id"] != actor_id:
+        raise ValueError("只有開單的人可以收單。")
+
+    conn.execute("UPDATE orders SET status='locked' WHERE order_id=?", (order_id,))
 
 
 def unlock_order(order_id: int, actor_id: str) -> None:
     """解鎖：將 locked 改回 open（僅開單者可用）。"""
-    with connect() as conn:
+    with batch() as conn:
         order = _get_order_row(conn, order_id)
 
         if order["status"] == "cancelled":
@@ -513,41 +661,91 @@ def unlock_order(order_id: int, actor_id: str) -> None:
             raise ValueError("只有開單的人可以解鎖此訂單。")
 
         conn.execute("UPDATE orders SET status='open' WHERE order_id=?", (order_id,))
-        conn.commit()
 
-def list_orders_for_picker(limit: int = 25) -> list[dict]:
+def list_orders_for_picker(limit: int = 25) -> list[sqlite3.Row]:
     """
-    給下拉選單用：列出最近的未作廢訂單
+    給下拉選單用：列出最近的未作廢訂單（回傳 sqlite3.Row）
     """
-    with connect() as conn:
-        rows = conn.execute(
-            """
-            SELECT order_id, vendor, created_at, status, creator_id, payer_id, discount_type, discount_value
-            FROM orders
-            WHERE status != 'cancelled'
-            ORDER BY order_id DESC
-            LIMIT ?
-            """,
-            (limit,),
-        ).fetchall()
-    return [dict(r) for r in rows]
+    conn = _reader_conn()
+    return conn.execute(
+        """
+        SELECT order_id, vendor, created_at, status, creator_id, payer_id, discount_type, discount_value
+        FROM orders
+        WHERE status != 'cancelled'
+        ORDER BY order_id DESC
+        LIMIT ?
+        """,
+        (limit,),
+    ).fetchall()
 
 
-def search_orders_for_picker(keyword: str, limit: int = 25) -> list[dict]:
+def _picker_filter(keyword: str) -> Tuple[str, tuple]:
+    """
+    autocomplete 的過濾條件（接在 WHERE status != 'cancelled' 後面），回傳 (SQL 片段, 參數)。
+    - 空字串：不過濾
+    - 純數字：order_id 完全相等
+    - vendor：3 個字以上走 orders_fts（trigram 索引）；更短的 trigram 查不了，直接 LIKE
+    """
+    kw = keyword.strip()
+    if not kw:
+        return "", ()
+
+    if len(kw) >= 3:
+        clause = "order_id IN (SELECT rowid FROM orders_fts WHERE vendor LIKE ?)"
+    else:
+        clause = "vendor LIKE ?"
+    params: tuple = (f"%{kw}%",)
+
+    if kw.isascii() and kw.isdecimal():  # isdigit() 會收 "²"、"①"，int() 轉不了
+        clause = f"order_id = ? OR {clause}"
+        params = (int(kw),) + params
+    return f"AND ({clause})", params
+
+
+def search_orders_for_picker(keyword: str, limit: int = 25) -> list[sqlite3.Row]:
     """
     給 autocomplete 用：依 keyword 過濾（可搜 order_id / vendor）
     """
-    kw = f"%{keyword.strip()}%"
-    with connect() as conn:
-        rows = conn.execute(
-            """
-            SELECT order_id, vendor, created_at, status, creator_id, payer_id, discount_type, discount_value
-            FROM orders
-            WHERE status != 'cancelled'
-              AND (CAST(order_id AS TEXT) LIKE ? OR vendor LIKE ?)
-            ORDER BY order_id DESC
-            LIMIT ?
-            """,
-            (kw, kw, limit),
-        ).fetchall()
-    return [dict(r) for r in rows]
+    where, params = _picker_filter(keyword)
+    conn = _reader_conn()
+    return conn.execute(
+        """
+        SELECT order_id, vendor, created_at, status, creator_id, payer_id, discount_type, discount_value
+        FROM orders
+        WHERE status != 'cancelled' {where}
+        ORDER BY order_id DESC
+        LIMIT ?
+        """.format(where=where),
+        params + (limit,),
+    ).fetchall()
+
+
+def search_orders_for_picker_labels(keyword: str, limit: int = 25) -> list[tuple[int, str]]:
+    """
+    同 search_orders_for_picker，但 label 直接在 SQL 組好，回傳 (order_id, label)。
+    label 格式：#12 | 50嵐 | 2024-01-01T12:00 | 開放中（最長 100 字，Discord 限制）
+    狀態文字要跟 bot.py 的 STATUS_LABEL 一致。
+    """
+    where, params = _picker_filter(keyword)
+    conn = _reader_conn()
+    rows = conn.execute(
+        """
+        SELECT order_id,
+               substr(
+                 '#' || order_id || ' | ' || vendor || ' | ' || substr(created_at, 1, 16) || ' | ' ||
+                 CASE status
+                   WHEN 'open' THEN '開放中'
+                   WHEN 'locked' THEN '收單'
+                   WHEN 'cancelled' THEN '作廢'
+                   ELSE status
+                 END,
+                 1, 100
+               ) AS label
+        FROM orders
+        WHERE status != 'cancelled' {where}
+        ORDER BY order_id DESC
+        LIMIT ?
+        """.format(where=where),
+        params + (limit,),
+    ).fetchall()
+    return [(r["order_id"], r["label"]) for r in rows]
@@ -21,12 +21,62 @@ def init_db() -> None:
     with sqlite3.connect(DB_PATH) as conn:
         conn.execute("PRAGMA foreign_keys = ON;")
         conn.execute("PRAGMA journal_mode = WAL;")
+        # 跟 src/db.py 的 _PRAGMAS 一致
+        conn.execute("PRAGMA synchronous = NORMAL;")
+        conn.execute("PRAGMA busy_timeout = 5000;")
+        conn.execute("PRAGMA cache_size = -20000;")
+        conn.execute("PRAGMA mmap_size = 268435456;")
+        conn.execute("PRAGMA temp_store = MEMORY;")
+        conn.execute("PRAGMA wal_autocheckpoint = 1000;")
         conn.executescript(schema_sql)
+        _migrate(conn)
+        # 舊資料補進全文索引（重建一次即可，資料量小）
+        conn.execute("INSERT INTO orders_fts(orders_fts) VALUES ('rebuild');")
+        # 建完（或改完）索引後更新統計，planner 才會選對索引
+        conn.execute("ANALYZE;")
         conn.commit()
 
     print(f"✅ DB 建立完成：{DB_PATH}")
 
 
+def _migrate(conn: sqlite3.Connection) -> None:
+    """舊 DB 補欄位（CREATE TABLE IF NOT EXISTS 不會改到已存在的表）。"""
+    cols = {r[1] for r in conn.execute("PRAGMA table_xinfo(line_items);")}
+    if "line_total" not in cols:
+        # ALTER TABLE 只能加 VIRTUAL 的 generated column：值一樣，只是讀的時候才算
+        conn.execute(
+            "ALTER TABLE line_items ADD COLUMN line_total INTEGER GENERATED ALWAYS AS (unit_price * qty) VIRTUAL;"
+        )
+
+    # table_xinfo 第 7 欄 hidden：0 = 一般欄位，2/3 = generated column
+    cols = {r[1]: r[6] for r in conn.execute("PRAGMA table_xinfo(orders);")}
+    if "discount_bps" not in cols:
+        conn.execute("ALTER TABLE orders ADD COLUMN discount_bps INTEGER NOT NULL DEFAULT 0;")
+        conn.execute(
+            "UPDATE orders SET discount_bps = CAST(ROUND(discount_value * 10000) AS INTEGER) WHERE discount_type='percent';"
+        )
+    if cols.get("discount_value") == 0:
+        # 舊的 discount_value 是自己存的一份：改成由 discount_bps 算出來，折扣只存一處
+        conn.execute("ALTER TABLE orders DROP COLUMN discount_value;")
+        conn.execute(
+            "ALTER TABLE orders ADD COLUMN discount_value REAL GENERATED ALWAYS AS (discount_bps / 10000.0) VIRTUAL;"
+        )
+
+    cols = {r[1] for r in conn.execute("PRAGMA table_xinfo(participants);")}
+    if "subtotal" not in cols:
+        conn.execute("ALTER TABLE participants ADD COLUMN subtotal INTEGER NOT NULL DEFAULT 0;")
+        conn.execute(
+            """
+            UPDATE participants
+            SET subtotal = (
+              SELECT COALESCE(SUM(li.unit_price * li.qty), 0)
+              FROM line_items li
+              WHERE li.order_id = participants.order_id AND li.user_id = participants.user_id
+            );
+            """
+        )
+
+
 def show_tables() -> None:
     with sqlite3.connect(DB_PATH) as conn:
         rows = conn.execute(
@@ -1,8 +1,12 @@
 from __future__ import annotations
 
+import sqlite3
 from pprint import pprint
 
 from db import (
+    _reader_conn,
+    _writer_conn,
+    batch,
     create_order,
     add_item,
     get_bill,
@@ -30,6 +34,24 @@ def print_bill(order_id: int) -> None:
     print("=" * 60)
 
 
+def check_get_bill_readonly(order_id: int) -> None:
+    """get_bill 走唯讀連線（mode=ro），而且完全不寫 DB。"""
+    writer = _writer_conn()
+    before = writer.total_changes
+    get_bill(order_id)
+    assert writer.total_changes == before, "get_bill 不應該有任何寫入"
+
+    reader = _reader_conn()
+    assert reader is not writer
+    try:
+        reader.execute("UPDATE orders SET note=note WHERE order_id=?", (order_id,))
+    except sqlite3.OperationalError:
+        pass  # attempt to write a readonly database
+    else:
+        raise AssertionError("reader 應該是 mode=ro 的唯讀連線")
+    print("✅ get_bill 只讀不寫")
+
+
 def main():
     # 用簡單的字串當 user_id（之後接 Discord 會用真正的 discord user id）
     A = "user_A"
@@ -38,11 +60,14 @@ def main():
     order_id = create_order(vendor="50嵐", creator_id=A, note="下午茶")
     print(f"✅ 已開單：#{order_id}")
 
-    add_item(order_id, user_id=A, name="珍奶微糖", unit_price=60, qty=1)
-    add_item(order_id, user_id=B, name="紅茶去冰", unit_price=40, qty=1)
-    add_item(order_id, user_id=B, name="波霸", unit_price=10, qty=1, note="加料")
+    # 一次加多筆：包在同一個 transaction，只 commit 一次
+    with batch():
+        add_item(order_id, user_id=A, name="珍奶微糖", unit_price=60, qty=1)
+        add_item(order_id, user_id=B, name="紅茶去冰", unit_price=40, qty=1)
+        add_item(order_id, user_id=B, name="波霸", unit_price=10, qty=1, note="加料")
 
     print_bill(order_id)
+    check_get_bill_readonly(order_id)
 
     print("\n✅ 設定整張單打九折（0.9）")
     set_discount_percent(order_id, 0.9)